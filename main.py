@@ -31,18 +31,47 @@ Versión: 1.0
 import os
 import json
 import logging
+import posixpath
+import threading
 import time
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from module.logging_config import configurar_logger
 from module.ssh import conectar_sftp, ListarArchivosSFTPconAtributos, DescargarArchivoSFTP
-from module.files import listar_subcarpetas, eliminar_antiguos
-
-
-def cargar_json(path):
+from module.files import (
+    iter_subcarpetas_con_ficheros,
+    ficheros_de_carpetas,
+    eliminar_antiguos,
+    cargar_cache_subcarpetas,
+    guardar_cache_subcarpetas,
+    invalidar_cache_subcarpetas,
+)
+
+# Caché de carpetas finales entre ejecuciones
+RUTA_CACHE_CARPETAS = "config/.leaf_cache.pkl"
+
+# orjson parsea JSON en C directamente desde bytes; si no está instalado
+# se usa el json de la librería estándar.
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+
+def cargar_json(path, descripcion="archivo"):
     """
     Carga un archivo JSON y devuelve su contenido como diccionario.
 
+    El archivo se abre directamente, sin comprobación previa de existencia:
+    si no está, el propio open lo detecta sin stat adicional ni condición
+    de carrera. Se lee en binario y se parsea con orjson si está
+    disponible, que decodifica el UTF-8 una sola vez.
+
     Args:
         path (str): Ruta absoluta o relativa al archivo JSON.
+        descripcion (str, opcional): Descripción del archivo para el mensaje
+            de error si no existe.
 
     Returns:
         dict: Contenido del JSON parseado.
@@ -50,9 +79,167 @@ def cargar_json(path):
     Raises:
         FileNotFoundError: Si el archivo no existe.
         json.JSONDecodeError: Si el contenido no es un JSON válido.
-    """    
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+    """
+    try:
+        with open(path, "rb") as f:
+            return _json_loads(f.read())
+    except FileNotFoundError:
+        raise FileNotFoundError(f"No se encuentra el {descripcion}: {path}") from None
+
+
+def _sftp_del_hilo(sesiones, credenciales, conexiones, config):
+    """
+    Devuelve la sesión SFTP persistente del hilo actual, abriéndola la
+    primera vez que el hilo la pide. Así cada hilo del pool paga un único
+    handshake SSH para todas sus carpetas.
+
+    Args:
+        sesiones (threading.local): Almacén por hilo de la sesión.
+        credenciales (list): Parámetros de conexión SFTP.
+        conexiones (list): Lista compartida donde se registran los pares
+            (sftp, transport) abiertos, para cerrarlos al final.
+        config (dict): Configuración general, de donde se leen los tamaños
+            de ventana y de paquete del transporte SSH.
+
+    Returns:
+        paramiko.SFTPClient: Sesión SFTP del hilo actual.
+    """
+    if getattr(sesiones, "sftp", None) is None:
+        sftp, transport = conectar_sftp(
+            credenciales,
+            window_size=config.get("sftp_window_size", 2 ** 28),
+            max_packet_size=config.get("sftp_max_packet_size", 2 ** 19),
+        )
+        sesiones.sftp = sftp
+        conexiones.append((sftp, transport))
+    return sesiones.sftp
+
+
+def cerrar_conexiones(conexiones):
+    """
+    Cierra los pares (sftp, transport) abiertos por los hilos del pool.
+
+    Args:
+        conexiones (list): Pares (sftp, transport) a cerrar.
+    """
+    for sftp, transport in conexiones:
+        try:
+            sftp.close()
+            transport.close()
+        except Exception:
+            pass
+
+
+def procesar_carpeta(carpeta_local, ficheros_locales, ruta_remota, config, credenciales,
+                     sesiones=None, conexiones=None, limpieza_executor=None, limpiezas=None):
+    """
+    Procesa una carpeta local: lista los archivos de la ruta remota
+    equivalente (que llega ya precalculada), descarga el más reciente si
+    no existe localmente y elimina las versiones antiguas.
+
+    Es segura para ejecutarse en paralelo desde varios hilos: cada hilo
+    reutiliza su propia sesión SFTP persistente si se pasa `sesiones`, y
+    en caso contrario cada llamada abre y cierra las suyas.
+
+    Args:
+        carpeta_local (str): Ruta de la carpeta local a sincronizar.
+        ficheros_locales (set | None): Nombres de los ficheros ya presentes
+            en la carpeta, obtenidos durante el recorrido inicial. Si es
+            None, la existencia local se comprueba contra el disco.
+        ruta_remota (str): Ruta remota equivalente, ya precalculada.
+        config (dict): Configuración general del sincronizador.
+        credenciales (list): Parámetros de conexión SFTP.
+        sesiones (threading.local, opcional): Almacén por hilo para
+            reutilizar una sesión SFTP persistente entre carpetas.
+        conexiones (list, opcional): Lista compartida donde registrar las
+            conexiones abiertas (obligatoria si se pasa sesiones).
+        limpieza_executor (ThreadPoolExecutor, opcional): Pool aparte al
+            que delegar la eliminación de ficheros antiguos, de modo que
+            el borrado en disco se solape con las descargas de red.
+        limpiezas (list, opcional): Lista compartida donde registrar los
+            futures de limpieza (obligatoria si se pasa limpieza_executor);
+            en ese caso el contador de eliminados devuelto es 0 y el real
+            se obtiene de los futures.
+
+    Returns:
+        tuple: (descargados, bytes_descargados, eliminados, error)
+            Contadores de la carpeta y un bool indicando si hubo error.
+    """
+    logger = logging.getLogger(__name__)
+    descargados = 0
+    bytes_descargados = 0
+    eliminados = 0
+    try:
+        sftp = None
+        if sesiones is not None:
+            sftp = _sftp_del_hilo(sesiones, credenciales, conexiones, config)
+
+        logger.info("Procesando carpeta local '%s' con ruta remota '%s'", carpeta_local, ruta_remota)
+
+        ok, archivos_remotos = ListarArchivosSFTPconAtributos(credenciales, ruta_remota, sftp=sftp,
+                                                              solo_mas_reciente=True)
+        if not ok:
+            logger.warning("No se pudo listar archivos en la ruta remota %s", ruta_remota)
+            if sesiones is not None:
+                # El fallo puede deberse a una sesión caída: descartarla
+                # para que la siguiente carpeta del hilo reconecte
+                sesiones.sftp = None
+            return descargados, bytes_descargados, eliminados, True
+
+        if not archivos_remotos:
+            logger.info("No hay archivos remotos en %s", ruta_remota)
+            return descargados, bytes_descargados, eliminados, False
+
+        # El listado ya viene reducido al archivo más reciente
+        archivo_reciente = archivos_remotos[0]
+        nombre_fichero = archivo_reciente["nombre"]
+        tamano_bytes = archivo_reciente["size"]
+        logger.info("Archivo más reciente en remoto: %s (%s bytes)", nombre_fichero, f"{tamano_bytes:,}")
+
+        # Comprobar si ya existe localmente (sin stat si el recorrido
+        # inicial ya nos dio los nombres de la carpeta)
+        destino_local = os.path.join(carpeta_local, nombre_fichero)
+        if ficheros_locales is not None:
+            ya_existe = nombre_fichero in ficheros_locales
+        else:
+            ya_existe = os.path.exists(destino_local)
+        if ya_existe:
+            logger.info("El fichero %s ya existe localmente. No se descarga.", nombre_fichero)
+        else:
+            descargado, ruta_descargada = DescargarArchivoSFTP(
+                credenciales, nombre_fichero, ruta_remota, destino_local,
+                max_prefetch=config.get("sftp_max_prefetch", 64), sftp=sftp,
+                size=tamano_bytes
+            )
+            if descargado:
+                descargados += 1
+                bytes_descargados += tamano_bytes
+                logger.info("Descargado correctamente %s a %s", nombre_fichero, ruta_descargada)
+            else:
+                logger.warning("No se pudo descargar el fichero %s", nombre_fichero)
+                if sesiones is not None:
+                    # Descartar también aquí la sesión del hilo por si la
+                    # descarga falló por una conexión caída
+                    sesiones.sftp = None
+
+        # Eliminar ficheros antiguos (en paralelo con las descargas
+        # restantes si hay pool de limpieza)
+        if limpieza_executor is not None:
+            limpiezas.append(limpieza_executor.submit(eliminar_antiguos, carpeta_local, nombre_fichero))
+        else:
+            eliminados = eliminar_antiguos(carpeta_local, nombre_fichero)
+            if eliminados == 0:
+                logger.debug("No había ficheros antiguos que eliminar en %s", carpeta_local)
+
+    except Exception as e:
+        logger.error("Error procesando la carpeta %s: %s", carpeta_local, e)
+        if sesiones is not None:
+            # Descartar la sesión del hilo por si quedó en mal estado;
+            # la siguiente carpeta abrirá una nueva.
+            sesiones.sftp = None
+        return descargados, bytes_descargados, eliminados, True
+
+    return descargados, bytes_descargados, eliminados, False
 
 
 def main():
@@ -63,7 +250,7 @@ def main():
     1. Carga de configuración y credenciales.
     2. Configuración del sistema de logging.
     3. Detección de subcarpetas locales a procesar.
-    4. Para cada carpeta:
+    4. Para cada carpeta (en paralelo, con un número de hilos configurable):
         - Construye la ruta remota equivalente.
         - Lista los archivos remotos y determina el más reciente.
         - Descarga el archivo si no existe localmente.
@@ -78,13 +265,8 @@ def main():
     config_path = "config/config.json"
     credenciales_path = "config/credenciales.json"
 
-    if not os.path.exists(config_path):
-        raise FileNotFoundError(f"No se encuentra el archivo de configuración: {config_path}")
-    if not os.path.exists(credenciales_path):
-        raise FileNotFoundError(f"No se encuentra el archivo de credenciales: {credenciales_path}")
-
-    config = cargar_json(config_path)
-    credenciales = cargar_json(credenciales_path)["SFTP"]
+    config = cargar_json(config_path, "archivo de configuración")
+    credenciales = cargar_json(credenciales_path, "archivo de credenciales")["SFTP"]
 
     # === 2️⃣ Configurar logging ===
     logger = configurar_logger(config)
@@ -93,12 +275,30 @@ def main():
     # === 3️⃣ Validar existencia del directorio base ===
     base_dir = config.get("directorio_local")
     if not base_dir or not os.path.isdir(base_dir):
-        logger.error(f"El directorio base '{base_dir}' no existe o no es válido.")
+        logger.error("El directorio base '%s' no existe o no es válido.", base_dir)
         return
 
-    # === 4️⃣ Obtener subcarpetas finales ===
-    carpetas = listar_subcarpetas(base_dir)
-    logger.info(f"Encontradas {len(carpetas)} carpetas finales para procesar.")
+    # === 4️⃣ Obtener subcarpetas finales y sus ficheros ===
+    # Si la configuración declara la lista de carpetas, se evita recorrer
+    # todo el árbol local
+    carpetas_declaradas = config.get("carpetas_locales")
+    guardar_cache = False
+    if carpetas_declaradas:
+        pares = ficheros_de_carpetas(carpetas_declaradas).items()
+        logger.info("Usando %d carpetas declaradas en la configuración.", len(pares))
+    else:
+        # Reutilizar la lista de carpetas de la ejecución anterior si el
+        # directorio base no ha cambiado; solo se releen los ficheros de
+        # cada carpeta final
+        carpetas_cacheadas = cargar_cache_subcarpetas(base_dir, RUTA_CACHE_CARPETAS)
+        if carpetas_cacheadas is not None:
+            pares = ficheros_de_carpetas(carpetas_cacheadas).items()
+            logger.info("Reutilizando %d carpetas finales de la caché.", len(pares))
+        else:
+            # Generador: las primeras carpetas entran al pool mientras el
+            # recorrido del árbol todavía continúa
+            pares = iter_subcarpetas_con_ficheros(base_dir)
+            guardar_cache = True
 
     # === Variables de resumen ===
     total_descargados = 0
@@ -106,70 +306,65 @@ def main():
     total_eliminados = 0
     carpetas_con_error = 0
 
-    # === 5️⃣ Procesar cada carpeta ===
-    for carpeta_local in carpetas:
-        try:
-            # Construir ruta remota equivalente
-            base_dir_normalizado = os.path.normpath(base_dir)
-            relativa = os.path.relpath(carpeta_local, base_dir_normalizado)
-            ruta_remota = os.path.join(config.get("directorio_remoto", "/"), relativa).replace("\\", "/")
-
-            logger.info(f"Procesando carpeta local '{carpeta_local}' con ruta remota '{ruta_remota}'")
-
-            ok, archivos_remotos = ListarArchivosSFTPconAtributos(credenciales, ruta_remota)
-            if not ok:
-                logger.warning(f"No se pudo listar archivos en la ruta remota {ruta_remota}")
-                carpetas_con_error += 1
-                continue
-
-            if not archivos_remotos:
-                logger.info(f"No hay archivos remotos en {ruta_remota}")
-                continue
-
-            # Obtener el más reciente (ya ordenados por fecha desc)
-            archivo_reciente = archivos_remotos[0]
-            nombre_fichero = archivo_reciente["nombre"]
-            tamano_bytes = archivo_reciente["size"]
-            logger.info(f"Archivo más reciente en remoto: {nombre_fichero} ({tamano_bytes:,} bytes)")
-
-            # Comprobar si ya existe localmente
-            destino_local = os.path.join(carpeta_local, nombre_fichero)
-            if os.path.exists(destino_local):
-                logger.info(f"El fichero {nombre_fichero} ya existe localmente. No se descarga.")
-            else:
-                descargado, ruta_descargada = DescargarArchivoSFTP(
-                    credenciales, nombre_fichero, ruta_remota, destino_local
-                )
-                if descargado:
-                    total_descargados += 1
-                    total_bytes_descargados += tamano_bytes
-                    logger.info(f"Descargado correctamente {nombre_fichero} a {ruta_descargada}")
-                else:
-                    logger.warning(f"No se pudo descargar el fichero {nombre_fichero}")
-
-            # Eliminar ficheros antiguos
-            eliminados = eliminar_antiguos(carpeta_local, nombre_fichero)
-            total_eliminados += eliminados
-            if eliminados > 0:
-                logger.info(f"{eliminados} ficheros antiguos eliminados en {carpeta_local}")
-            else:
-                logger.debug(f"No había ficheros antiguos que eliminar en {carpeta_local}")
-
-        except Exception as e:
-            carpetas_con_error += 1
-            logger.error(f"Error procesando la carpeta {carpeta_local}: {e}")
+    # === 5️⃣ Procesar las carpetas en paralelo ===
+    max_workers = config.get("sftp_workers", 8)
+    base_norm = os.path.normpath(base_dir)
+    remote_base = config.get("directorio_remoto", "/")
+    sesiones = threading.local()
+    conexiones = []
+    limpiezas = []
+    carpetas = []
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor, \
+             ThreadPoolExecutor(max_workers=2) as limpieza_executor:
+            tarea = functools.partial(procesar_carpeta,
+                                      config=config, credenciales=credenciales,
+                                      sesiones=sesiones, conexiones=conexiones,
+                                      limpieza_executor=limpieza_executor, limpiezas=limpiezas)
+            # Enviar las tareas según el recorrido va produciendo carpetas,
+            # calculando la ruta remota en la misma pasada
+            futuros = []
+            for carpeta_local, ficheros_locales in pares:
+                carpetas.append(carpeta_local)
+                relativa = os.path.relpath(carpeta_local, base_norm).replace(os.sep, "/")
+                futuros.append(executor.submit(tarea, carpeta_local, ficheros_locales,
+                                               posixpath.join(remote_base, relativa)))
+            if guardar_cache:
+                guardar_cache_subcarpetas(base_dir, RUTA_CACHE_CARPETAS, carpetas)
+                logger.info("Encontradas %d carpetas finales para procesar.", len(carpetas))
+            for futuro in futuros:
+                descargados, bytes_descargados, eliminados, error = futuro.result()
+                total_descargados += descargados
+                total_bytes_descargados += bytes_descargados
+                total_eliminados += eliminados
+                if error:
+                    carpetas_con_error += 1
+            # Recoger las limpiezas que se solaparon con las descargas
+            for futuro in limpiezas:
+                total_eliminados += futuro.result()
+    finally:
+        cerrar_conexiones(conexiones)
+        if carpetas_con_error > 0:
+            # Forzar un recorrido completo en la siguiente ejecución
+            invalidar_cache_subcarpetas(RUTA_CACHE_CARPETAS)
 
     # === 6️⃣ Resumen final ===
     duracion = time.time() - inicio
     minutos, segundos = divmod(int(duracion), 60)
-    logger.info("=== Resumen de ejecución ===")
-    logger.info(f"Tiempo total de proceso: {minutos} min {segundos} seg")
-    logger.info(f"Carpetas procesadas: {len(carpetas)}")
-    logger.info(f"Ficheros descargados: {total_descargados}")
-    logger.info(f"Bytes descargados: {total_bytes_descargados:,}")
-    logger.info(f"Ficheros eliminados localmente: {total_eliminados}")
-    logger.info(f"Carpetas con errores: {carpetas_con_error}")
-    logger.info("=== Proceso finalizado correctamente ===")
+    # Un único registro de log para todo el resumen: un solo bloqueo del
+    # handler y una sola escritura atómica
+    logger.info(
+        "=== Resumen de ejecución ===\n"
+        "Tiempo total de proceso: %d min %d seg\n"
+        "Carpetas procesadas: %d\n"
+        "Ficheros descargados: %d\n"
+        "Bytes descargados: %s\n"
+        "Ficheros eliminados localmente: %d\n"
+        "Carpetas con errores: %d\n"
+        "=== Proceso finalizado correctamente ===",
+        minutos, segundos, len(carpetas), total_descargados,
+        f"{total_bytes_descargados:,}", total_eliminados, carpetas_con_error,
+    )
 
 
 if __name__ == "__main__":
@@ -25,14 +25,112 @@ Autor: [Tu nombre o equipo]
 Versión: 1.0
 """
 import os
+import pickle
 import logging
 
 logger = logging.getLogger(__name__)
 
+def _leaf_dirs(path):
+    """
+    Generador recursivo que recorre un directorio con os.scandir y produce
+    las carpetas finales (las que no contienen subcarpetas) junto con los
+    nombres de los ficheros que contienen.
+
+    A diferencia de os.walk, reutiliza el tipo de entrada cacheado en cada
+    DirEntry, de modo que solo se hace una lectura de directorio por carpeta
+    sin llamadas stat adicionales por fichero. Los enlaces simbólicos se
+    ignoran para evitar ciclos, y las carpetas que no se pueden leer (por
+    permisos o porque desaparecen durante el recorrido) se descartan con un
+    aviso, igual que hacía os.walk.
+
+    Args:
+        path (str): Ruta del directorio a recorrer.
+
+    Yields:
+        tuple: (ruta, ficheros) de cada carpeta final, donde ficheros es la
+            lista de nombres de los ficheros que contiene.
+    """
+    subdirs = 0
+    ficheros = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_symlink():
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs += 1
+                    yield from _leaf_dirs(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    ficheros.append(entry.name)
+    except OSError as e:
+        logger.warning("Se omite la carpeta %s: %s", path, e)
+        return
+    if subdirs == 0:
+        yield path, ficheros
+
+
+def _base_vacia(base_path):
+    """
+    Comprueba con una sola lectura de directorio si base_path está vacío.
+    Un directorio que no se puede leer cuenta como vacío, con un aviso.
+
+    Args:
+        base_path (str): Ruta a comprobar.
+
+    Returns:
+        bool: True si el directorio no contiene ninguna entrada.
+    """
+    try:
+        with os.scandir(base_path) as it:
+            return next(it, None) is None
+    except OSError as e:
+        logger.warning("No se puede leer el directorio base %s: %s", base_path, e)
+        return True
+
+
+def iter_subcarpetas(base_path):
+    """
+    Genera las carpetas finales dentro de base_path (aquellas que no
+    contienen subcarpetas) a medida que el recorrido las encuentra, sin
+    esperar a completar el árbol. Si base_path está vacío no produce nada.
+
+    Args:
+        base_path (str): Ruta base a recorrer.
+
+    Yields:
+        str: Ruta de cada carpeta final.
+    """
+    if _base_vacia(base_path):
+        return
+    for carpeta, _ in _leaf_dirs(base_path):
+        yield carpeta
+
+
+def iter_subcarpetas_con_ficheros(base_path):
+    """
+    Genera las carpetas finales de base_path junto con los nombres de los
+    ficheros que contiene cada una, a medida que el recorrido con
+    os.scandir las encuentra y sin llamadas stat adicionales. Si base_path
+    está vacío no produce nada.
+
+    Args:
+        base_path (str): Ruta base a recorrer.
+
+    Yields:
+        tuple: (ruta de carpeta final, set de nombres de fichero).
+    """
+    if _base_vacia(base_path):
+        return
+    for carpeta, ficheros in _leaf_dirs(base_path):
+        yield carpeta, set(ficheros)
+
+
 def listar_subcarpetas(base_path):
     """
     Devuelve una lista con todas las carpetas finales dentro de base_path
-    (aquellas que no contienen subcarpetas).
+    (aquellas que no contienen subcarpetas), sin duplicados y conservando
+    el orden del recorrido. Si base_path está vacío se devuelve []
+    sin recorrer nada.
 
     Args:
         base_path (str): Ruta base a recorrer.
@@ -40,11 +138,107 @@ def listar_subcarpetas(base_path):
     Returns:
         list: Lista de rutas absolutas de carpetas finales.
     """
-    subcarpetas = []
-    for root, dirs, files in os.walk(base_path):
-        if not dirs:  # Solo carpetas finales
-            subcarpetas.append(root)
-    return subcarpetas
+    return list(dict.fromkeys(iter_subcarpetas(base_path)))
+
+
+def listar_subcarpetas_con_ficheros(base_path):
+    """
+    Devuelve las carpetas finales de base_path junto con los nombres de los
+    ficheros que contiene cada una. Si base_path está vacío se devuelve {}
+    sin recorrer nada; las carpetas repetidas se quedan con la última
+    aparición.
+
+    Args:
+        base_path (str): Ruta base a recorrer.
+
+    Returns:
+        dict: Diccionario {ruta de carpeta final: set de nombres de fichero}.
+    """
+    return dict(iter_subcarpetas_con_ficheros(base_path))
+
+
+def cargar_cache_subcarpetas(base_path, ruta_cache):
+    """
+    Recupera la lista de carpetas finales guardada por una ejecución
+    anterior, siempre que la fecha de modificación del directorio base no
+    haya cambiado desde que se guardó.
+
+    Args:
+        base_path (str): Ruta base cuyo recorrido se quiere evitar.
+        ruta_cache (str): Ruta del fichero de caché.
+
+    Returns:
+        list | None: Lista de carpetas finales cacheada, o None si no hay
+            caché válida.
+    """
+    try:
+        with open(ruta_cache, "rb") as f:
+            datos = pickle.load(f)
+        if datos.get("mtime") == os.stat(base_path).st_mtime_ns:
+            return datos.get("carpetas")
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+        pass
+    return None
+
+
+def guardar_cache_subcarpetas(base_path, ruta_cache, carpetas):
+    """
+    Guarda la lista de carpetas finales junto con la fecha de modificación
+    actual del directorio base, para reutilizarla en la siguiente ejecución.
+
+    Args:
+        base_path (str): Ruta base recorrida.
+        ruta_cache (str): Ruta del fichero de caché.
+        carpetas (list): Lista de carpetas finales encontradas.
+    """
+    try:
+        datos = {"mtime": os.stat(base_path).st_mtime_ns, "carpetas": carpetas}
+        with open(ruta_cache, "wb") as f:
+            pickle.dump(datos, f)
+    except OSError as e:
+        logger.warning("No se pudo guardar la caché de carpetas en %s: %s", ruta_cache, e)
+
+
+def invalidar_cache_subcarpetas(ruta_cache):
+    """
+    Elimina el fichero de caché de carpetas si existe, para forzar un
+    recorrido completo en la siguiente ejecución.
+
+    Args:
+        ruta_cache (str): Ruta del fichero de caché.
+    """
+    try:
+        os.unlink(ruta_cache)
+    except OSError:
+        pass
+
+
+def ficheros_de_carpetas(carpetas):
+    """
+    Devuelve los nombres de los ficheros de una lista de carpetas ya
+    conocidas, con una sola lectura de directorio por carpeta y sin
+    llamadas stat de validación previas: si una carpeta no existe o no es
+    un directorio, el propio os.scandir lo detecta y se descarta con un
+    aviso.
+
+    Args:
+        carpetas (list): Rutas de las carpetas a examinar.
+
+    Returns:
+        dict: Diccionario {ruta de carpeta: set de nombres de fichero},
+            solo con las carpetas válidas.
+    """
+    resultado = {}
+    for carpeta in carpetas:
+        try:
+            with os.scandir(carpeta) as it:
+                resultado[carpeta] = {
+                    entry.name for entry in it
+                    if entry.is_file(follow_symlinks=False)
+                }
+        except OSError as e:
+            logger.warning("Se descarta la carpeta declarada %s: %s", carpeta, e)
+    return resultado
 
 
 def fichero_mas_reciente(sftp, remote_dir):
@@ -64,7 +258,7 @@ def fichero_mas_reciente(sftp, remote_dir):
             return None
         return max(files, key=lambda f: f.st_mtime)
     except Exception as e:
-        logger.error(f"Error buscando fichero más reciente en {remote_dir}: {e}")
+        logger.error("Error buscando fichero más reciente en %s: %s", remote_dir, e)
         return None
 
 
@@ -80,13 +274,19 @@ def eliminar_antiguos(carpeta, ultimo_fichero):
         int: Número de ficheros eliminados.
     """
     eliminados = 0
+    debug_on = logger.isEnabledFor(logging.DEBUG)
     try:
-        for fichero in os.listdir(carpeta):
-            ruta = os.path.join(carpeta, fichero)
-            if os.path.isfile(ruta) and fichero != ultimo_fichero:
-                os.remove(ruta)
-                eliminados += 1
-                logger.info(f"Eliminado fichero antiguo: {ruta}")
+        with os.scandir(carpeta) as it:
+            for entry in it:
+                if entry.name == ultimo_fichero:
+                    continue
+                if entry.is_file(follow_symlinks=False):
+                    os.unlink(entry.path)
+                    eliminados += 1
+                    if debug_on:
+                        logger.debug("Eliminado fichero antiguo: %s", entry.path)
+        if eliminados > 0:
+            logger.info("Eliminados %d ficheros antiguos en %s", eliminados, carpeta)
     except Exception as e:
-        logger.error(f"Error eliminando ficheros antiguos en {carpeta}: {e}")
+        logger.error("Error eliminando ficheros antiguos en %s: %s", carpeta, e)
     return eliminados
@@ -37,18 +37,27 @@ Versión: 1.0
 import logging
 import sys
 import os
+import shutil
 import datetime
 import paramiko
 
 logger = logging.getLogger(__name__)
 
-def conectar_sftp(credenciales):
+def conectar_sftp(credenciales, window_size=2 ** 28, max_packet_size=2 ** 19):
     """
     Establece la conexión con el servidor SFTP usando credenciales.
 
+    El transporte se crea con una ventana y un tamaño de paquete mayores
+    que los de Paramiko por defecto, para que los enlaces de alta latencia
+    no se queden parados esperando confirmaciones de control de flujo.
+
     Args:
         credenciales (list): Lista con los parámetros de conexión en este orden:
             [servidor, puerto, usuario, clave, clave_privada, pass_clave_privada]
+        window_size (int, opcional): Tamaño de la ventana SSH en bytes.
+            Default 2**28 (256 MB).
+        max_packet_size (int, opcional): Tamaño máximo de paquete SSH en
+            bytes. Default 2**19 (512 KB).
 
     Returns:
         tuple: (sftp, transport)
@@ -56,7 +65,9 @@ def conectar_sftp(credenciales):
             - transport (paramiko.Transport): Transporte activo que debe cerrarse.
     """
     sftp_servidor, sftp_puerto, sftp_usuario, sftp_clave, sftp_claveprivada, sftp_passclaveprivada = credenciales
-    transport = paramiko.Transport((sftp_servidor, sftp_puerto))
+    transport = paramiko.Transport((sftp_servidor, sftp_puerto),
+                                   default_window_size=window_size,
+                                   default_max_packet_size=max_packet_size)
     if os.path.isfile(sftp_claveprivada):
         transport.connect(username=sftp_usuario, pkey=paramiko.RSAKey.from_private_key_file(sftp_claveprivada, password=sftp_passclaveprivada or None))
     else:
@@ -183,16 +194,30 @@ def ListarArchivosSFTP(credenciales, carpeta):
     return Aux, ListaFicheros
 
 
-def DescargarArchivoSFTP(credenciales, archivo, ruta='/', destino_local=None):
+def DescargarArchivoSFTP(credenciales, archivo, ruta='/', destino_local=None, max_prefetch=64, sftp=None,
+                         size=None):
     """
     Descarga un archivo desde el servidor SFTP a la carpeta local especificada.
 
+    La descarga usa el prefetch de Paramiko con un número acotado de
+    peticiones de lectura concurrentes, de modo que el rendimiento queda
+    limitado por el ancho de banda y no por la latencia de cada petición.
+
     Args:
         credenciales (list): Lista con los parámetros de conexión.
         archivo (str): Nombre del archivo remoto a descargar.
         ruta (str, opcional): Carpeta remota donde está el archivo. Default '/'.
         destino_local (str, opcional): Ruta local completa donde guardar el archivo.
             Si no se indica, se descargará en el directorio actual del programa.
+        max_prefetch (int, opcional): Máximo de peticiones de lectura
+            concurrentes durante el prefetch. Default 64 (el mismo que el
+            cliente sftp de OpenSSH).
+        sftp (paramiko.SFTPClient, opcional): Sesión SFTP ya abierta a
+            reutilizar. Si no se indica, se abre y cierra una propia.
+        size (int, opcional): Tamaño del archivo remoto en bytes, si ya se
+            conoce por el listado previo. Permite arrancar el prefetch sin
+            el stat adicional que sftp.get hace internamente, ahorrando un
+            ida y vuelta por descarga.
 
     Returns:
         tuple:
@@ -201,8 +226,10 @@ def DescargarArchivoSFTP(credenciales, archivo, ruta='/', destino_local=None):
     """
     Aux = False
     NombreFicheroLocal = ''
+    transport = None
     try:
-        sftp, transport = conectar_sftp(credenciales)
+        if sftp is None:
+            sftp, transport = conectar_sftp(credenciales)
 
         # Construir la ruta remota
         remoteFile = os.path.join(ruta, archivo).replace("\\", "/")
@@ -214,14 +241,24 @@ def DescargarArchivoSFTP(credenciales, archivo, ruta='/', destino_local=None):
             # Asegurarse de que exista la carpeta destino
             os.makedirs(os.path.dirname(destino_local), exist_ok=True)
 
-        # Descargar el archivo
-        sftp.get(remoteFile, destino_local)
+        # Descargar el archivo con prefetch acotado
+        if size is not None:
+            # El tamaño ya se conoce por el listado: abrir y prefetch
+            # directamente, sin el stat interno de sftp.get
+            with sftp.open(remoteFile, "rb") as fichero_remoto:
+                fichero_remoto.prefetch(size, max_prefetch)
+                with open(destino_local, "wb") as fichero_local:
+                    shutil.copyfileobj(fichero_remoto, fichero_local, 32768)
+        else:
+            sftp.get(remoteFile, destino_local, prefetch=True,
+                     max_concurrent_prefetch_requests=max_prefetch)
 
         Aux = True
         NombreFicheroLocal = destino_local
 
-        sftp.close()
-        transport.close()
+        if transport is not None:
+            sftp.close()
+            transport.close()
 
     except Exception as e:
         Cadena = f"No consigo descargar el fichero {archivo} del servidor {credenciales[0]}"
@@ -261,7 +298,7 @@ def VerificarFicheroSFTP(credenciales, archivo, ruta='/'):
     return Aux
 
 
-def ListarArchivosSFTPconAtributos(credenciales, carpeta):
+def ListarArchivosSFTPconAtributos(credenciales, carpeta, sftp=None, solo_mas_reciente=False):
     """
     Lista los archivos de una carpeta con sus atributos
     (tamaño, fechas, permisos, etc.), ordenados por fecha de modificación.
@@ -269,6 +306,11 @@ def ListarArchivosSFTPconAtributos(credenciales, carpeta):
     Args:
         credenciales (list): Lista con los parámetros de conexión.
         carpeta (str): Carpeta remota a listar.
+        sftp (paramiko.SFTPClient, opcional): Sesión SFTP ya abierta a
+            reutilizar. Si no se indica, se abre y cierra una propia.
+        solo_mas_reciente (bool, opcional): Si es True, devuelve solo el
+            archivo más reciente, calculado con max() en lugar de ordenar
+            toda la lista.
 
     Returns:
         tuple:
@@ -277,10 +319,15 @@ def ListarArchivosSFTPconAtributos(credenciales, carpeta):
     """
     Aux = False
     Lista = []
+    transport = None
     try:
-        sftp, transport = conectar_sftp(credenciales)
+        if sftp is None:
+            sftp, transport = conectar_sftp(credenciales)
         archivos = sftp.listdir_attr(carpeta)
-        archivos.sort(key=lambda x: x.st_mtime, reverse=True)
+        if solo_mas_reciente:
+            archivos = [max(archivos, key=lambda x: x.st_mtime)] if archivos else []
+        else:
+            archivos.sort(key=lambda x: x.st_mtime, reverse=True)
         for atributos in archivos:
             diccionario_atributos = {
                 'nombre': atributos.filename,
@@ -293,8 +340,9 @@ def ListarArchivosSFTPconAtributos(credenciales, carpeta):
             }
             Lista.append(diccionario_atributos)
         Aux = True
-        sftp.close()
-        transport.close()
+        if transport is not None:
+            sftp.close()
+            transport.close()
     except Exception as e:
         Cadena = f"No consigo conectar con el servidor {credenciales[0]} con el usuario {credenciales[2]}"
         logger.error(Cadena)